@@ -3,19 +3,24 @@
 Simple data collector script for TriMet bus breadcrumb data.
 This script fetches breadcrumb data from the TriMet API and publishes
 individual records to a Google Cloud Pub/Sub topic.
-Uses concurrent.futures for parallel processing to improve performance.
+Uses asyncio with a shared aiohttp session to fetch vehicles concurrently.
 """
 
 import os
-import json
-import urllib.request
+import time
+import asyncio
 import datetime
 import logging
+import functools
 import traceback
+import threading
+import multiprocessing
 import concurrent.futures
+import aiohttp
+import orjson
 from google.cloud import pubsub_v1
 from google.cloud.pubsub_v1.publisher.futures import Future as PublishFuture
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Optional, Tuple
 
 # Set up logging configuration
 logging.basicConfig(
@@ -33,165 +38,378 @@ PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT", "dataeng-456707")
 PUBSUB_TOPIC = "breadcrumb-data-topic"
 API_BASE_URL = "https://busdata.cs.pdx.edu/api/getBreadCrumbs"
 OUTPUT_DIR = "./busdata/raw_data"
-MAX_WORKERS = 10  # Maximum number of parallel workers for vehicle processing
-PUBSUB_BATCH_SIZE = 100  # Number of messages to publish in batch
+MAX_WORKERS = 50  # Maximum number of vehicles fetched concurrently
+PROCESS_WORKERS = os.cpu_count() or 1  # Worker processes for parsing and serializing responses
+FETCH_CHUNK_BYTES = 64 * 1024  # Size of each read from an API response body
+HTTP_KEEPALIVE_SECS = 60  # Seconds an idle pooled connection stays open for reuse
+HTTP_DNS_CACHE_SECS = 300  # Seconds a resolved API host address is reused
+PUBSUB_MAX_MESSAGES = 1000  # Messages per publish request before the batch is sent
+PUBSUB_MAX_BYTES = 5 * 1024 * 1024  # Bytes per publish request before the batch is sent
+PUBSUB_MAX_LATENCY = 0.05  # Seconds to wait for a batch to fill before sending it
+JSON_WHITESPACE = b" \t\n\r"  # Insignificant whitespace between JSON tokens
 
-# Ensure output directory exists
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Pub/Sub publisher shared by every vehicle, created by init_publisher() in the
+# main process only
+publisher = None
+topic_path = None
+
+# Raw archive file descriptors by date, opened lazily in each worker process
+_archive_fds = {}
+
+# Today's local date string, cached until the clock passes the next midnight
+_today_str = ""
+_today_epoch_bound = 0.0
+
+def _refresh_today() -> str:
+    global _today_str, _today_epoch_bound
+    now = datetime.datetime.now()
+    next_midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    # Publish the new string before the new bound so readers never pair a
+    # fresh bound with a stale date
+    _today_str = now.strftime("%Y-%m-%d")
+    _today_epoch_bound = next_midnight.timestamp()
+    return _today_str
+
+def today_str() -> str:
+    """Return today's date as YYYY-MM-DD, only reformatting it once per day."""
+    if time.time() < _today_epoch_bound:
+        return _today_str
+    return _refresh_today()
+
+def init_publisher() -> None:
+    """
+    Create the Pub/Sub publisher once so its channel and batching threads are
+    shared by every vehicle. Only main() calls this, so worker processes (which
+    re-import this module under spawn) never build a client of their own.
+    """
+    global publisher, topic_path
+    publisher = pubsub_v1.PublisherClient(
+        batch_settings=pubsub_v1.types.BatchSettings(
+            max_messages=PUBSUB_MAX_MESSAGES,
+            max_bytes=PUBSUB_MAX_BYTES,
+            max_latency=PUBSUB_MAX_LATENCY,
+        )
+    )
+    topic_path = publisher.topic_path(PROJECT_ID, PUBSUB_TOPIC)
+
+@functools.lru_cache(maxsize=1)
+def _load_vehicle_ids() -> List[str]:
+    with open("ids.txt", 'r') as f:
+        return [vehicle_id for line in f if (vehicle_id := line.strip())]
 
 def read_vehicle_ids() -> List[str]:
-    """Read vehicle IDs from ids.txt file."""
+    """Read vehicle IDs from ids.txt file (cached after the first successful read)."""
     try:
-        with open("ids.txt", 'r') as f:
-            vehicle_ids = [line.strip() for line in f.readlines() if line.strip()]
-            logger.info(f"Read {len(vehicle_ids)} vehicle IDs from ids.txt")
-            return vehicle_ids
+        vehicle_ids = _load_vehicle_ids()
+        logger.info("Read %d vehicle IDs from ids.txt", len(vehicle_ids))
+        return vehicle_ids
     except Exception as e:
-        logger.error(f"Error reading vehicle IDs from file: {e}")
+        logger.error("Error reading vehicle IDs from file: %s", e)
         # Return some default IDs as fallback
         return ["VEHICLE_ID_1", "VEHICLE_ID_2", "VEHICLE_ID_3"]
 
-def fetch_breadcrumb_data(vehicle_id: str) -> Optional[List[Dict[str, Any]]]:
-    """Fetch breadcrumb data for a specific vehicle ID."""
+async def fetch_breadcrumb_data(session: aiohttp.ClientSession, vehicle_id: str) -> Optional[bytearray]:
+    """Fetch the raw breadcrumb response body for a specific vehicle ID."""
     url = f"{API_BASE_URL}?vehicle_id={vehicle_id}"
     
     try:
-        logger.info(f"Fetching data for vehicle {vehicle_id}...")
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read())
-            logger.info(f"Received {len(data)} records for vehicle {vehicle_id}")
-            return data
+        logger.debug("Fetching data for vehicle %s...", vehicle_id)
+        async with session.get(url) as response:
+            response.raise_for_status()
+            # Accumulate the body in place rather than joining a list of
+            # chunks into a second full-size copy
+            raw = bytearray()
+            async for chunk in response.content.iter_chunked(FETCH_CHUNK_BYTES):
+                raw += chunk
+            return raw
     except Exception as e:
-        logger.error(f"Error fetching data for vehicle {vehicle_id}: {e}")
+        logger.error("Error fetching data for vehicle %s: %s", vehicle_id, e)
         return None
 
-def save_raw_data(vehicle_id: str, data: List[Dict[str, Any]]) -> None:
-    """Save raw data to a file."""
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    filename = f"{OUTPUT_DIR}/vehicle_{vehicle_id}_{today}.json"
+def _get_archive_fd(date_str: str) -> int:
+    """Get the append-mode descriptor for a day's raw archive, opening it once per process per day."""
+    fd = _archive_fds.get(date_str)
+    if fd is None:
+        # The date has changed (or this is the first save), so close the old archive
+        for old_fd in _archive_fds.values():
+            os.close(old_fd)
+        _archive_fds.clear()
+        
+        filename = f"{OUTPUT_DIR}/raw_{date_str}.jsonl"
+        fd = _archive_fds[date_str] = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    return fd
+
+def save_raw_data(vehicle_id: str, records: List[bytes]) -> None:
+    """
+    Append a vehicle's records to the day's archive as a single JSON line.
+    Only records that have already been validated as JSON are embedded.
+    """
+    date_str = today_str()
     
     try:
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+        # The records are embedded as-is; newlines can only be insignificant
+        # whitespace in valid JSON, so dropping them keeps it on one line
+        line = b"".join((
+            b'{"vehicle_id":', orjson.dumps(vehicle_id),
+            b',"records":[', b",".join(records).replace(b"\n", b""), b"]}\n",
+        ))
+        
+        # One O_APPEND write per vehicle, so lines from concurrent worker
+        # processes never interleave
+        written = os.write(_get_archive_fd(date_str), line)
+        if written != len(line):
+            raise OSError(f"short write ({written} of {len(line)} bytes)")
         
-        logger.info(f"Saved raw data for vehicle {vehicle_id} to {filename}")
+        logger.info("Saved raw data for vehicle %s to %s/raw_%s.jsonl", vehicle_id, OUTPUT_DIR, date_str)
     except Exception as e:
-        logger.error(f"Error saving raw data for vehicle {vehicle_id}: {e}")
+        logger.error("Error saving raw data for vehicle %s: %s", vehicle_id, e)
+
+def split_records(raw: bytearray) -> Optional[List[bytes]]:
+    """
+    Split a JSON array of flat objects into the raw bytes of each object, without
+    re-serializing it. The body is scanned in place by offset, so only the
+    per-record slices are copied. Each object is still validated with orjson before
+    it is returned. Returns None if the body is anything else (nested objects,
+    escapes, braces inside strings, or invalid JSON), in which case it must be
+    parsed properly.
+    """
+    start, end = 0, len(raw)
+    while start < end and raw[start] in JSON_WHITESPACE:
+        start += 1
+    while end > start and raw[end - 1] in JSON_WHITESPACE:
+        end -= 1
+    if end - start < 2 or raw[start] != ord("[") or raw[end - 1] != ord("]"):
+        return None
+    # Without escapes, quotes always delimit strings, so an odd quote count
+    # in a record means its closing "}" was found inside a string
+    if raw.find(b"\\", start, end) >= 0:
+        return None
+    
+    view = memoryview(raw)
+    records = []
+    append = records.append
+    separator = b""
+    pos = start + 1
+    close = end - 1  # Offset of the closing "]"
+    while True:
+        open_brace = raw.find(b"{", pos, close)
+        if open_brace < 0:
+            # Only whitespace may follow the last record
+            return records if not raw[pos:close].strip(JSON_WHITESPACE) else None
+        # Records are normally packed with just the separator between them; only
+        # slice out the gap to strip it when there is whitespace as well
+        if (open_brace - pos != len(separator) or not raw.startswith(separator, pos)) \
+                and raw[pos:open_brace].strip(JSON_WHITESPACE) != separator:
+            return None
+        close_brace = raw.find(b"}", open_brace, close)
+        if (close_brace < 0 or raw.find(b"{", open_brace + 1, close_brace) >= 0
+                or raw.count(b'"', open_brace, close_brace) & 1):
+            return None
+        
+        record = bytes(view[open_brace:close_brace + 1])
+        # The brace checks above only find record boundaries; make sure the
+        # record itself is valid JSON before it is forwarded as-is
+        try:
+            orjson.loads(record)
+        except orjson.JSONDecodeError:
+            return None
+        append(record)
+        separator = b","
+        pos = close_brace + 1
+
+def prepare_payloads(vehicle_id: str, raw: bytearray) -> List[bytes]:
+    """
+    Split a vehicle's raw response into per-record Pub/Sub payloads and save it.
+    Runs in a worker process so JSON work is not serialized behind the GIL.
+    Returns the list of per-record payloads (empty if there was no data).
+    """
+    # Forward each record's bytes as received; only fall back to a full
+    # parse and re-serialize when the body cannot be split safely
+    payloads = split_records(raw)
+    if payloads is None:
+        try:
+            records = orjson.loads(raw)
+        except orjson.JSONDecodeError as e:
+            logger.error("Invalid JSON response for vehicle %s: %s", vehicle_id, e)
+            return []
+        # Anything but an array (null, a string, an error object) has no records
+        if not isinstance(records, list):
+            logger.warning("Response for vehicle %s is not a JSON array (got %s)", vehicle_id, type(records).__name__)
+            return []
+        payloads = [orjson.dumps(record) for record in records]
+    logger.info("Received %d records for vehicle %s", len(payloads), vehicle_id)
+    
+    if not payloads:
+        return []
+    
+    # Save the raw data, rebuilt from the validated records
+    save_raw_data(vehicle_id, payloads)
+    
+    return payloads
 
-def publish_to_pubsub(records: List[Dict[str, Any]]) -> Tuple[int, int]:
+class _PublishTally:
     """
-    Publish individual breadcrumb records to Pub/Sub using futures for parallel processing.
+    Thread-safe success/error counter fed by publish future callbacks.
+    wait() blocks until every expected future has reported back.
+    """
+
+    def __init__(self, expected: int) -> None:
+        self.expected = expected
+        self.published = 0
+        self.errors = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def record(self, future: PublishFuture) -> None:
+        try:
+            future.result()
+            succeeded = True
+        except Exception as e:
+            succeeded = False
+            logger.error("Error publishing message: %s - %s", type(e).__name__, e)
+        with self._cond:
+            if succeeded:
+                self.published += 1
+            else:
+                self.errors += 1
+            self._cond.notify_all()
+
+    def wait(self) -> Tuple[int, int]:
+        with self._cond:
+            self._cond.wait_for(lambda: self.published + self.errors >= self.expected)
+            return self.published, self.errors
+
+def publish_to_pubsub(payloads: List[bytes]) -> Tuple[int, int]:
+    """
+    Publish serialized breadcrumb records to Pub/Sub without blocking on each message.
+    All publishes are submitted up front and confirmed asynchronously through
+    future callbacks; the futures are drained once at the end.
     Returns a tuple of (published_count, error_count).
     """
-    if not records:
+    if not payloads:
         logger.warning("No records to publish to Pub/Sub")
         return 0, 0
     
-    # Initialize Pub/Sub publisher
     try:
-        publisher = pubsub_v1.PublisherClient()
-        topic_path = publisher.topic_path(PROJECT_ID, PUBSUB_TOPIC)
+        logger.info("Publishing %d records to Pub/Sub topic %s", len(payloads), PUBSUB_TOPIC)
         
-        logger.info(f"Publishing {len(records)} records to Pub/Sub topic {PUBSUB_TOPIC}")
+        tally = _PublishTally(len(payloads))
+        publish = publisher.publish
+        record_outcome = tally.record
         
-        published_count = 0
-        error_count = 0
-        futures = []
+        # Submit every payload without waiting; the client batches them on the wire
+        # and the outcome is counted when each future resolves
+        for payload in payloads:
+            publish(topic_path, data=payload).add_done_callback(record_outcome)
         
-        # Create a batch of publish futures
-        for record in records:
-            # Convert the record to a JSON string
-            data = json.dumps(record).encode("utf-8")
-            
-            # Publish the message and keep track of the future
-            future = publisher.publish(topic_path, data=data)
-            futures.append(future)
-            
-            # If we've reached our batch size, wait for them to complete
-            if len(futures) >= PUBSUB_BATCH_SIZE:
-                for future in futures:
-                    try:
-                        future.result()  # Wait for the future to complete
-                        published_count += 1
-                    except Exception as e:
-                        error_count += 1
-                        logger.error(f"Error publishing message: {type(e).__name__} - {str(e)}")
-                futures = []  # Clear the futures list for the next batch
-        
-        # Process any remaining futures
-        for future in futures:
-            try:
-                future.result()
-                published_count += 1
-            except Exception as e:
-                error_count += 1
-                logger.error(f"Error publishing message: {type(e).__name__} - {str(e)}")
+        # Wait once for all outstanding publishes to be confirmed
+        published_count, error_count = tally.wait()
         
-        logger.info(f"Summary: Published {published_count}/{len(records)} records to {PUBSUB_TOPIC}")
+        logger.info("Summary: Published %d/%d records to %s", published_count, len(payloads), PUBSUB_TOPIC)
         if error_count > 0:
-            logger.warning(f"Failed to publish {error_count} records. See logs for details.")
+            logger.warning("Failed to publish %d records. See logs for details.", error_count)
             
         return published_count, error_count
             
     except Exception as e:
         error_type = type(e).__name__
-        logger.error(f"Fatal error initializing Pub/Sub client: {error_type} - {str(e)}")
-        logger.error(f"Check if PROJECT_ID and PUBSUB_TOPIC are correctly defined:")
-        logger.error(f"PROJECT_ID: {PROJECT_ID}, PUBSUB_TOPIC: {PUBSUB_TOPIC}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        return 0, len(records) if records else 0
+        logger.error("Fatal error publishing to Pub/Sub: %s - %s", error_type, e)
+        logger.error("Check if PROJECT_ID and PUBSUB_TOPIC are correctly defined:")
+        logger.error("PROJECT_ID: %s, PUBSUB_TOPIC: %s", PROJECT_ID, PUBSUB_TOPIC)
+        logger.error("Traceback: %s", traceback.format_exc())
+        return 0, len(payloads)
 
-def process_vehicle(vehicle_id: str) -> Tuple[str, int, int]:
+async def process_vehicle(
+    session: aiohttp.ClientSession,
+    pool: concurrent.futures.ProcessPoolExecutor,
+    vehicle_id: str,
+) -> Tuple[str, int, int]:
     """
     Process a single vehicle: fetch data, save raw data, and publish to Pub/Sub.
     Returns a tuple of (vehicle_id, published_count, error_count).
     """
     # Fetch data
-    data = fetch_breadcrumb_data(vehicle_id)
+    raw = await fetch_breadcrumb_data(session, vehicle_id)
     
-    if not data:
-        logger.warning(f"No data received for vehicle {vehicle_id}")
+    if not raw:
+        logger.warning("No data received for vehicle %s", vehicle_id)
         return vehicle_id, 0, 0
     
-    # Save the raw data
-    save_raw_data(vehicle_id, data)
+    # Parse, save and serialize in a worker process
+    loop = asyncio.get_running_loop()
+    payloads = await loop.run_in_executor(pool, prepare_payloads, vehicle_id, raw)
+    
+    if not payloads:
+        logger.warning("No data received for vehicle %s", vehicle_id)
+        return vehicle_id, 0, 0
     
-    # Publish individual records to Pub/Sub
-    published_count, error_count = publish_to_pubsub(data)
+    # Publish individual records to Pub/Sub off the event loop, since it
+    # blocks until every publish is confirmed
+    published_count, error_count = await asyncio.to_thread(publish_to_pubsub, payloads)
     
     return vehicle_id, published_count, error_count
 
+async def collect(vehicle_ids: List[str]) -> Tuple[int, int]:
+    """
+    Fetch and process all vehicles concurrently over one pooled HTTP session,
+    handing the CPU-bound JSON work to a pool of worker processes.
+    Returns a tuple of (total_published, total_errors).
+    """
+    total_published = 0
+    total_errors = 0
+    
+    # Share one connection pool across every request. All requests go to the
+    # same API host, so keep idle sockets (and the resolved address) around
+    # long enough for later vehicles to reuse them instead of paying for a
+    # new TCP + TLS handshake each time.
+    connector = aiohttp.TCPConnector(
+        limit=MAX_WORKERS,
+        limit_per_host=MAX_WORKERS,
+        keepalive_timeout=HTTP_KEEPALIVE_SECS,
+        ttl_dns_cache=HTTP_DNS_CACHE_SECS,
+    )
+    # Start workers with spawn rather than fork: forking would copy the live gRPC
+    # publisher (and its threads) into every worker
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=PROCESS_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as pool:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            results = await asyncio.gather(
+                *(process_vehicle(session, pool, vehicle_id) for vehicle_id in vehicle_ids),
+                return_exceptions=True,
+            )
+    
+    for vehicle_id, result in zip(vehicle_ids, results):
+        if isinstance(result, BaseException):
+            logger.error("Error processing vehicle %s: %s", vehicle_id, result)
+            continue
+        _, published_count, error_count = result
+        total_published += published_count
+        total_errors += error_count
+    
+    return total_published, total_errors
+
 def main() -> None:
-    """Main function to fetch and process breadcrumb data using concurrent futures."""
+    """Main function to fetch and process breadcrumb data using asyncio."""
     start_time = datetime.datetime.now()
-    logger.info(f"Starting data collection at {start_time}")
+    logger.info("Starting data collection at %s", start_time)
+    
+    # Ensure output directory exists
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    
+    init_publisher()
     
     # Read vehicle IDs from file
     vehicle_ids = read_vehicle_ids()
     
-    total_published = 0
-    total_errors = 0
-    
-    # Process vehicles in parallel using ThreadPoolExecutor
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Submit all vehicle processing tasks
-        future_to_vehicle = {executor.submit(process_vehicle, vehicle_id): vehicle_id for vehicle_id in vehicle_ids}
-        
-        # Process results as they complete
-        for future in concurrent.futures.as_completed(future_to_vehicle):
-            vehicle_id = future_to_vehicle[future]
-            try:
-                _, published_count, error_count = future.result()
-                total_published += published_count
-                total_errors += error_count
-            except Exception as e:
-                logger.error(f"Error processing vehicle {vehicle_id}: {e}")
+    # Process vehicles concurrently on the event loop
+    total_published, total_errors = asyncio.run(collect(vehicle_ids))
     
     end_time = datetime.datetime.now()
     duration = (end_time - start_time).total_seconds()
-    logger.info(f"Data collection completed at {end_time}")
-    logger.info(f"Total duration: {duration:.2f} seconds")
-    logger.info(f"Total published: {total_published}, Total errors: {total_errors}")
+    logger.info("Data collection completed at %s", end_time)
+    logger.info("Total duration: %.2f seconds", duration)
+    logger.info("Total published: %d, Total errors: %d", total_published, total_errors)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
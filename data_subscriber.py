@@ -6,10 +6,12 @@ and saves them to daily files.
 """
 
 import os
-import json
 import time
+import threading
 import datetime
 import logging
+import orjson
+from google.api_core.exceptions import DeadlineExceeded, GoogleAPICallError, RetryError
 from google.cloud import pubsub_v1
 
 # Import configuration if available
@@ -35,6 +37,12 @@ logger = logging.getLogger('data_subscriber')
 
 # Define output directory
 OUTPUT_DIR = "/opt/busdata/output"
+BUFFER_BYTES = 128 * 1024  # Size of each day's reusable write buffer; written out when full
+FLUSH_SECS = 5  # Write all buffered records at least this often
+PULL_MAX_MESSAGES = 1000  # Maximum number of messages requested per pull
+PULL_TIMEOUT = 10  # Seconds to wait for a pull to return messages
+PULL_BACKOFF_MIN = 1.0  # Initial sleep after a pull that returned no messages
+PULL_BACKOFF_MAX = 15.0  # Longest sleep between pulls while the subscription is idle
 
 # Ensure output directory exists
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -43,93 +51,294 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 subscriber = pubsub_v1.SubscriberClient()
 subscription_path = subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_NAME)
 
-# Dictionary to store daily files
+# Dictionary to store daily files (raw file descriptors opened for append)
 daily_files = {}
 
+# Pending output bytes per date (as _WriteBuffer), written to the daily files in bulk.
+# buffer_lock guards write_buffers and daily_files, which are shared between
+# the pull loop and the periodic flush timer.
+write_buffers = {}
+buffer_lock = threading.Lock()
+flush_timer = None
+rotation_timer = None
+
+# Cached current date, used for records without a timestamp and for rotation
+_today_str = ""
+_today_epoch_bound = 0.0
+
+def _refresh_today():
+    global _today_str, _today_epoch_bound
+    now = datetime.datetime.now()
+    next_midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    _today_str = now.strftime("%Y-%m-%d")
+    _today_epoch_bound = next_midnight.timestamp()
+    return _today_str
+
+def today_str():
+    """Return today's date as YYYY-MM-DD, only reformatting it once per day."""
+    if time.time() < _today_epoch_bound:
+        return _today_str
+    return _refresh_today()
+
+class _WriteBuffer:
+    """
+    Fixed-size byte buffer that is allocated once and reused.
+    Flushing only resets the fill level, so steady-state appends never allocate.
+    """
+    __slots__ = ("data", "view", "size")
+
+    def __init__(self):
+        self.data = bytearray(BUFFER_BYTES)
+        self.view = memoryview(self.data)
+        self.size = 0
+
 def get_daily_file(date_str):
-    """Get or create a file handle for the specified date."""
+    """Get or create a file descriptor for the specified date."""
     if date_str not in daily_files:
         filename = f"{OUTPUT_DIR}/breadcrumbs_{date_str}.jsonl"
-        daily_files[date_str] = open(filename, 'a')
-        logger.info(f"Created/opened file for {date_str}: {filename}")
+        daily_files[date_str] = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        logger.info("Created/opened file for %s: %s", date_str, filename)
     
     return daily_files[date_str]
 
 def close_old_files(current_date_str):
     """Close file handles for dates other than the current date."""
-    for date_str, file_handle in list(daily_files.items()):
-        if date_str != current_date_str:
-            file_handle.close()
-            del daily_files[date_str]
-            logger.info(f"Closed file for {date_str}")
-
-def process_message(message):
-    """Process a Pub/Sub message and write to the appropriate daily file."""
-    try:
-        # Parse the message data
-        data = json.loads(message.data.decode("utf-8"))
-        
-        # Extract timestamp from the data (assuming it exists)
-        # If timestamp is not available, use the current date
-        if "timestamp" in data:
-            # Parse the timestamp to get the date
-            # Assuming timestamp format is like "2025-04-13 14:30:45"
-            date_str = data["timestamp"].split()[0]
-        else:
-            date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-        
-        # Get the file handle for this date
-        file_handle = get_daily_file(date_str)
-        
-        # Write the record to the file (as a JSON line)
-        file_handle.write(json.dumps(data) + "\n")
-        file_handle.flush()  # Ensure data is written immediately
-        
-        # Acknowledge the message
-        message.ack()
+    with buffer_lock:
+        for date_str, fd in list(daily_files.items()):
+            if date_str != current_date_str:
+                flush_buffer(date_str)
+                write_buffers.pop(date_str, None)
+                os.close(fd)
+                del daily_files[date_str]
+                logger.info("Closed file for %s", date_str)
+
+def flush_buffer(date_str):
+    """Write the buffered records for a date to its daily file. Caller must hold buffer_lock."""
+    buf = write_buffers.get(date_str)
+    if buf is not None and buf.size:
+        fd = get_daily_file(date_str)
+        # Write straight to the descriptor, retrying on short writes. If a write
+        # fails, keep only the unwritten tail so the next flush doesn't repeat bytes.
+        written = 0
+        try:
+            while written < buf.size:
+                written += os.write(fd, buf.view[written:buf.size])
+        finally:
+            remaining = buf.size - written
+            if written and remaining:
+                buf.view[:remaining] = buf.data[written:buf.size]
+            buf.size = remaining
+
+def flush_all_buffers():
+    """Write every date's buffered records to disk."""
+    with buffer_lock:
+        for date_str in list(write_buffers):
+            flush_buffer(date_str)
+
+def buffer_records(date_str, records):
+    """
+    Append encoded records to the date's buffer as JSON lines. Either the whole
+    batch is buffered or written, or an OSError is raised and none of it is.
+    """
+    data = b"\n".join(records) + b"\n"
+    with buffer_lock:
+        buf = write_buffers.get(date_str)
+        if buf is None:
+            buf = write_buffers[date_str] = _WriteBuffer()
+        if buf.size + len(data) > BUFFER_BYTES:
+            # Make room by writing out what is already buffered
+            flush_buffer(date_str)
         
-        # Close old files if date has changed
-        current_date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-        close_old_files(current_date_str)
+        if len(data) <= BUFFER_BYTES:
+            buf.view[buf.size:buf.size + len(data)] = data
+            buf.size += len(data)
+            return
         
+        # Too big to buffer: write the batch straight to the file, truncating any
+        # partial write away on failure so the file never ends in half a batch
+        fd = get_daily_file(date_str)
+        start = os.lseek(fd, 0, os.SEEK_END)
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[os.write(fd, view):]
+        except OSError:
+            if len(view) < len(data):
+                os.ftruncate(fd, start)
+            raise
+
+def start_flush_timer():
+    """Schedule the next periodic flush of all buffered records."""
+    global flush_timer
+    flush_timer = threading.Timer(FLUSH_SECS, _flush_timer_tick)
+    flush_timer.daemon = True
+    flush_timer.start()
+
+def _flush_timer_tick():
+    try:
+        flush_all_buffers()
     except Exception as e:
-        logger.error(f"Error processing message: {e}", exc_info=True)
-        # Negative acknowledgement - the message will be redelivered
-        message.nack()
+        logger.error("Error flushing buffered records: %s", e, exc_info=True)
+    start_flush_timer()
+
+def start_rotation_timer():
+    """Schedule the closing of the previous day's files for just after the next local midnight."""
+    global rotation_timer
+    now = datetime.datetime.now()
+    next_midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    rotation_timer = threading.Timer((next_midnight - now).total_seconds(), _rotation_timer_tick)
+    rotation_timer.daemon = True
+    rotation_timer.start()
+
+def _rotation_timer_tick():
+    try:
+        close_old_files(today_str())
+    except Exception as e:
+        logger.error("Error closing old daily files: %s", e, exc_info=True)
+    start_rotation_timer()
+
+def process_messages(received_messages):
+    """
+    Process a batch of pulled Pub/Sub messages, writing each day's records in one go.
+    Returns a tuple of (ack_ids, nack_ids) for the messages that were processed
+    successfully and those that failed.
+    """
+    records_by_date = {}
+    ack_ids_by_date = {}
+    ack_ids = []
+    nack_ids = []
+    
+    for received in received_messages:
+        try:
+            # Parse the message data
+            data = orjson.loads(received.message.data)
+            problem = None if isinstance(data, dict) else "not a JSON object"
+        except orjson.JSONDecodeError as e:
+            problem = e
+        if problem is not None:
+            # Redelivery can't fix a malformed payload, so acknowledge and drop it
+            # rather than nacking it back onto the subscription forever
+            logger.error("Dropping undecodable message %s: %s (data: %r)",
+                         received.message.message_id, problem, received.message.data[:200])
+            ack_ids.append(received.ack_id)
+            continue
+        
+        try:
+            # Extract timestamp from the data (assuming it exists)
+            # If timestamp is not available, use the current date
+            if "timestamp" in data:
+                # Take the date prefix of the timestamp
+                # Assuming timestamp format is like "2025-04-13 14:30:45"
+                date_str = data["timestamp"][:10]
+            else:
+                date_str = today_str()
+            
+            records_by_date.setdefault(date_str, []).append(orjson.dumps(data))
+            ack_ids_by_date.setdefault(date_str, []).append(received.ack_id)
+        except Exception as e:
+            logger.error("Error processing message: %s", e, exc_info=True)
+            nack_ids.append(received.ack_id)
+    
+    # Buffer each day's records (as JSON lines); they are written out with
+    # the rest of the day's batch by size or by the flush timer
+    for date_str, records in records_by_date.items():
+        try:
+            buffer_records(date_str, records)
+            ack_ids.extend(ack_ids_by_date[date_str])
+        except OSError as e:
+            # The write failed (e.g. disk full), so have these messages redelivered
+            # instead of acknowledging records that never reached the file
+            logger.error("Error writing records for %s: %s", date_str, e, exc_info=True)
+            nack_ids.extend(ack_ids_by_date[date_str])
+    
+    return ack_ids, nack_ids
 
 def main():
     """Main function to receive and process messages from Pub/Sub."""
-    logger.info(f"Starting subscriber on {SUBSCRIPTION_NAME}...")
-    logger.info(f"Using project: {PROJECT_ID}")
-    logger.info(f"Output directory: {OUTPUT_DIR}")
+    logger.info("Starting subscriber on %s...", SUBSCRIPTION_NAME)
+    logger.info("Using project: %s", PROJECT_ID)
+    logger.info("Output directory: %s", OUTPUT_DIR)
     
-    # Configure the subscriber
-    streaming_pull_future = subscriber.subscribe(
-        subscription_path, 
-        callback=process_message
-    )
+    # Start writing buffered records out periodically, and closing the
+    # previous day's files once the date changes
+    start_flush_timer()
+    start_rotation_timer()
     
     try:
         # Keep the subscriber running indefinitely
-        logger.info(f"Listening for messages on {subscription_path}...")
-        streaming_pull_future.result()
+        logger.info("Listening for messages on %s...", subscription_path)
+        backoff = PULL_BACKOFF_MIN
+        while True:
+            # Pull a batch of messages in a single RPC
+            try:
+                received_messages = subscriber.pull(
+                    subscription=subscription_path,
+                    max_messages=PULL_MAX_MESSAGES,
+                    timeout=PULL_TIMEOUT,
+                ).received_messages
+            except DeadlineExceeded:
+                received_messages = []
+            except (GoogleAPICallError, RetryError) as e:
+                # Transient failures (e.g. UNAVAILABLE outlasting the client's retry)
+                # shouldn't stop the daemon; back off like an empty pull and try again
+                logger.error("Error pulling messages, retrying in %.0fs: %s", backoff, e)
+                received_messages = []
+            
+            # Back off geometrically while the subscription is idle, and go
+            # back to pulling straight away as soon as messages arrive
+            if not received_messages:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, PULL_BACKOFF_MAX)
+                continue
+            backoff = PULL_BACKOFF_MIN
+            
+            ack_ids, nack_ids = process_messages(received_messages)
+            
+            try:
+                # Acknowledge the whole batch in a single RPC
+                if ack_ids:
+                    subscriber.acknowledge(subscription=subscription_path, ack_ids=ack_ids)
+                
+                # Negative acknowledgement for the failures, also in a single RPC -
+                # a zero ack deadline makes them available for redelivery right away
+                if nack_ids:
+                    subscriber.modify_ack_deadline(
+                        subscription=subscription_path,
+                        ack_ids=nack_ids,
+                        ack_deadline_seconds=0,
+                    )
+            except (GoogleAPICallError, RetryError) as e:
+                # Messages left unacknowledged are redelivered once their ack
+                # deadline lapses, so log it, back off and keep pulling
+                logger.error("Error acknowledging messages, retrying in %.0fs: %s", backoff, e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, PULL_BACKOFF_MAX)
     except KeyboardInterrupt:
-        streaming_pull_future.cancel()
         logger.info("Subscriber stopped by user.")
     except Exception as e:
-        streaming_pull_future.cancel()
-        logger.error(f"Subscriber stopped due to error: {e}", exc_info=True)
+        logger.error("Subscriber stopped due to error: %s", e, exc_info=True)
     finally:
-        # Close all file handles
-        for date_str, file_handle in daily_files.items():
-            file_handle.close()
-            logger.info(f"Closed file for {date_str}")
+        # Write out anything still buffered before closing the files
+        if flush_timer is not None:
+            flush_timer.cancel()
+        if rotation_timer is not None:
+            rotation_timer.cancel()
+        try:
+            flush_all_buffers()
+        except Exception as e:
+            # Still close the files and the client, and run the transform
+            logger.error("Error flushing buffered records on shutdown: %s", e, exc_info=True)
+        
+        # Close all file descriptors
+        for date_str, fd in daily_files.items():
+            os.close(fd)
+            logger.info("Closed file for %s", date_str)
         
         # Close the subscriber client
         subscriber.close()
         logger.info("Subscriber client closed.")
 
-        logger.info(f"Starting transformation for {date_str}...")
+        logger.info("Starting transformation for %s...", date_str)
 
         try:
             # Import the transform module
@@ -138,17 +347,17 @@ def main():
             # Run the transformation
             transform.main(date_str, logger)
             
-            logger.info(f"Transformation completed for {date_str}")
+            logger.info("Transformation completed for %s", date_str)
         except Exception as e:
-            logger.error(f"Error during transformation for {date_str}: {e}", exc_info=True)
+            logger.error("Error during transformation for %s: %s", date_str, e, exc_info=True)
 
 if __name__ == "__main__":
     try:
         main()
     except Exception as e:
-        logger.critical(f"Unhandled exception in main function: {e}", exc_info=True)
+        logger.critical("Unhandled exception in main function: %s", e, exc_info=True)
     finally:
-        logger.info(f"Starting transformation for {date_str}...")
+        logger.info("Starting transformation for %s...", date_str)
 
         try:
             # Import the transform module
@@ -157,6 +366,6 @@ if __name__ == "__main__":
             # Run the transformation
             transform.main(date_str, logger)
             
-            logger.info(f"Transformation completed for {date_str}")
+            logger.info("Transformation completed for %s", date_str)
         except Exception as e:
-            logger.error(f"Error during transformation for {date_str}: {e}", exc_info=True)
+            logger.error("Error during transformation for %s: %s", date_str, e, exc_info=True)
@@ -4,9 +4,15 @@ Data transformation script for TriMet bus breadcrumb data.
 This script processes JSONL breadcrumb files and loads them into PostgreSQL.
 """
 
-import json
+import calendar
+import io
+import mmap
+import operator
+import struct
+import numpy as np
+import orjson
 import psycopg2
-from psycopg2.extras import execute_values
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import os
 import logging
@@ -21,67 +27,190 @@ db_params = {
     'port': '5432'
 }
 
-# Function to parse OPD_DATE and ACT_TIME into a timestamp
-def parse_timestamp(opd_date, act_time, logger):
+# PostgreSQL binary COPY framing
+PG_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack('!ii', 0, 0)  # signature, flags, extension length
+PG_COPY_TRAILER = struct.pack('!h', -1)
+PG_EPOCH_SECONDS = calendar.timegm((2000, 1, 1, 0, 0, 0))  # Binary timestamps count microseconds from here
+BREADCRUMB_FIELD_COUNT = 5
+NULL_LENGTH = -1
+MICROSECONDS_PER_SECOND = 1_000_000
+
+# Breadcrumb fields used downstream, pulled from each parsed record in one call
+BREADCRUMB_FIELDS = operator.itemgetter(
+    'EVENT_NO_TRIP', 'ACT_TIME', 'METERS', 'GPS_LATITUDE', 'GPS_LONGITUDE', 'VEHICLE_ID', 'OPD_DATE'
+)
+
+# OPD_DATE month abbreviations (fixed, so parsing doesn't depend on the locale)
+_MONTHS = {
+    'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4, 'MAY': 5, 'JUN': 6,
+    'JUL': 7, 'AUG': 8, 'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12
+}
+
+# Parsed OPD_DATE days keyed by their "25DEC2022" prefix; a day file has just one.
+# Values that failed to parse are cached as None.
+_opd_date_cache = {}
+
+# Function to write a column of values, converted to the given big-endian dtype,
+# into buf at the per-row byte offsets
+def scatter_column(buf, offsets, values, dtype):
+    # Reshape by item size, not row count, so an empty column (e.g. all-NULL floats) still works
+    raw = np.ascontiguousarray(values, dtype=dtype).view(np.uint8).reshape(-1, np.dtype(dtype).itemsize)
+    buf[offsets[:, None] + np.arange(raw.shape[1])] = raw
+
+# Function to encode breadcrumb columns (tstamp, latitude, longitude, speed, trip_id)
+# as a PostgreSQL binary COPY stream. Timestamps are microseconds since 2000-01-01;
+# NaN floats are written as NULL. Rows are laid out in one preallocated buffer and
+# filled a column at a time, so there is no per-row Python work.
+def build_breadcrumb_copy_buffer(timestamps, latitudes, longitudes, speeds, trip_ids):
+    count = len(timestamps)
+    floats = [(column, ~np.isnan(column)) for column in (latitudes, longitudes, speeds)]
+    
+    # Each row: field count (2) + tstamp (4 + 8) + three floats (4, + 8 unless NULL) + trip_id (4 + 8)
+    row_sizes = np.full(count, 2 + 12 + 3 * 4 + 12, dtype=np.int64)
+    for _, present in floats:
+        row_sizes += 8 * present
+    offsets = np.empty(count, dtype=np.int64)
+    offsets[0] = len(PG_COPY_HEADER)
+    np.cumsum(row_sizes[:-1], out=offsets[1:])
+    offsets[1:] += len(PG_COPY_HEADER)
+    
+    body_end = len(PG_COPY_HEADER) + int(row_sizes.sum())
+    buf = np.empty(body_end + len(PG_COPY_TRAILER), dtype=np.uint8)
+    buf[:len(PG_COPY_HEADER)] = np.frombuffer(PG_COPY_HEADER, dtype=np.uint8)
+    buf[body_end:] = np.frombuffer(PG_COPY_TRAILER, dtype=np.uint8)
+    
+    scatter_column(buf, offsets, np.full(count, BREADCRUMB_FIELD_COUNT), '>i2')
+    offsets += 2
+    scatter_column(buf, offsets, np.full(count, 8), '>i4')
+    scatter_column(buf, offsets + 4, timestamps, '>i8')
+    offsets += 12
+    for column, present in floats:
+        scatter_column(buf, offsets, np.where(present, 8, NULL_LENGTH), '>i4')
+        offsets += 4
+        scatter_column(buf, offsets[present], column[present], '>f8')
+        offsets += 8 * present
+    scatter_column(buf, offsets, np.full(count, 8), '>i4')
+    scatter_column(buf, offsets + 4, trip_ids, '>i8')
+    
+    return io.BytesIO(buf.tobytes())
+
+# Function to compute per-breadcrumb speeds (meters per second) from columns sorted
+# by trip and ACT_TIME, given each trip's first row (starts) and row count (counts).
+# Each speed is the change in METERS over the change in ACT_TIME since the previous
+# breadcrumb of the same trip (NaN when undefined); the first breadcrumb of a trip
+# takes the speed of the second.
+def compute_speeds(act_times, meters, starts, counts):
+    count = len(act_times)
+    speeds = np.full(count, np.nan)
+    
+    # Mark the first breadcrumb of every trip
+    trip_start = np.zeros(count, dtype=bool)
+    trip_start[starts] = True
+    
+    # Successive differences, only valid within a trip and moving forward in time
+    time_diff = np.diff(act_times)
+    meters_diff = np.diff(meters)
+    valid = ~trip_start[1:] & (time_diff > 0)
+    speeds[1:][valid] = meters_diff[valid] / time_diff[valid]
+    
+    # For first breadcrumb, use speed of second breadcrumb (as per assignment)
+    firsts = starts[counts > 1]
+    speeds[firsts] = speeds[firsts + 1]
+    
+    return speeds
+
+# Function to parse OPD_DATE (e.g., "25DEC2022:00:00:00") into the datetime of that day's midnight
+def parse_opd_date(opd_date, logger):
+    key = day = None
     try:
-        # Parse the date part (e.g., "25DEC2022:00:00:00")
-        date_str = opd_date.split(':')[0]  # "25DEC2022"
-        day = int(date_str[:2])
-        month_str = date_str[2:5]
-        year = int(date_str[5:])
-        
-        # Convert month string to number
-        months = {
-            'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4, 'MAY': 5, 'JUN': 6,
-            'JUL': 7, 'AUG': 8, 'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12
-        }
-        month = months[month_str]
-        
-        # Calculate hours, minutes, seconds from ACT_TIME (seconds since midnight)
-        # Handle cases where ACT_TIME exceeds 24 hours (86400 seconds)
-        days_to_add = act_time // 86400  # Number of days to add
-        seconds_in_day = act_time % 86400  # Remaining seconds in the day
-        
-        hours = seconds_in_day // 3600
-        minutes = (seconds_in_day % 3600) // 60
-        seconds = seconds_in_day % 60
-        
-        # Create base datetime object
-        base_date = datetime(year, month, day, hours, minutes, seconds)
-        
-        # Add any additional days if ACT_TIME exceeded 24 hours
-        if days_to_add > 0:
-            base_date = base_date + timedelta(days=days_to_add)
-            
-        return base_date
+        key = opd_date[:9]  # "25DEC2022"
+        if key in _opd_date_cache:
+            return _opd_date_cache[key]
+        day = datetime(int(key[5:]), _MONTHS[key[2:5]], int(key[:2]))
     except Exception as e:
-        logger.error(f"Error parsing timestamp: {opd_date}, {act_time} - {str(e)}")
-        return None
+        logger.error(f"Error parsing OPD_DATE: {opd_date} - {str(e)}")
+    
+    # Cache failures too, so each bad value is only parsed and reported once
+    if isinstance(key, str):
+        _opd_date_cache[key] = day
+    return day
+
+# Function to determine the service_key from the day of the week
+def get_service_key(day):
+    # 5 = Saturday, 6 = Sunday, 0-4 = Weekday
+    weekday = day.weekday()
+    if weekday == 5:
+        return 'Saturday'
+    elif weekday == 6:
+        return 'Sunday'
+    return 'Weekday'
+
+# Function to compute breadcrumb timestamps as microseconds since the PostgreSQL
+# epoch: midnight of OPD_DATE plus ACT_TIME seconds (ACT_TIME may run past 24 hours).
+# Each distinct OPD_DATE is parsed once to whole seconds since the epoch; the rest
+# is int64 arithmetic on the ACT_TIME column. A daily file normally has one date.
+# Returns (timestamps, keep) where keep masks out rows whose OPD_DATE didn't parse,
+# or is None when every row is valid.
+def compute_timestamps(opd_dates, act_times, logger):
+    distinct_dates = set(opd_dates)
+    day_starts_by_date = {}
+    for opd_date in distinct_dates:
+        day = parse_opd_date(opd_date, logger)
+        if day is not None:
+            day_starts_by_date[opd_date] = calendar.timegm(day.timetuple()) - PG_EPOCH_SECONDS
+    
+    if len(distinct_dates) == 1 and day_starts_by_date:
+        # Single-date file: one scalar offset for every row
+        (day_start,) = day_starts_by_date.values()
+        return (act_times + day_start) * MICROSECONDS_PER_SECOND, None
+    
+    count = len(opd_dates)
+    keep = np.fromiter((opd_date in day_starts_by_date for opd_date in opd_dates), dtype=bool, count=count)
+    day_starts = np.fromiter((day_starts_by_date.get(opd_date, 0) for opd_date in opd_dates), dtype=np.int64, count=count)
+    return (act_times + day_starts) * MICROSECONDS_PER_SECOND, keep
 
 # Function to remove existing data for a specific date
 def remove_existing_data(date_str, conn, cursor, logger):
     try:
-        # Start a subtransaction
-        cursor.execute("SAVEPOINT before_delete")
-        
         # Delete existing breadcrumbs for the date
         cursor.execute("""
             DELETE FROM BreadCrumb
-            WHERE DATE(tstamp) = %s
-        """, (date_str,))
+            WHERE tstamp >= %(day)s::date AND tstamp < %(day)s::date + INTERVAL '1 day'
+        """, {'day': date_str})
         
         affected_rows = cursor.rowcount
         logger.info(f"Removed {affected_rows} existing breadcrumbs for {date_str}")
-        
-        # Commit the subtransaction
-        cursor.execute("RELEASE SAVEPOINT before_delete")
         return True
     except Exception as e:
-        # Rollback to the savepoint
-        cursor.execute("ROLLBACK TO SAVEPOINT before_delete")
+        # The transaction is now aborted; the caller skips the file and nothing is committed
         logger.error(f"Error removing existing data for {date_str}: {str(e)}")
         return False
 
+# Function to read and parse a JSONL breadcrumb file in one pass via mmap.
+# Returns the parsed records and the number of lines read.
+def read_breadcrumb_file(file_path, logger):
+    breadcrumbs = []
+    # Read JSONL file (each line is a separate JSON object)
+    with open(file_path, 'rb') as f:
+        data = b''
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[:]
+    lines = data.split(b'\n')
+    del data
+    if not lines[-1]:
+        lines.pop()  # Trailing newline
+    
+    for line_no, line in enumerate(lines, 1):
+        try:
+            bc = orjson.loads(line)
+            breadcrumbs.append(bc)
+        except orjson.JSONDecodeError:
+            logger.warning(f"Error decoding JSON at line {line_no} in {file_path}")
+            continue
+    
+    return breadcrumbs, len(lines)
+
 # Function to process a specific JSONL file
 def process_day_file(date_str, logger, clear_existing=True):
     # Construct file path based on the date
@@ -103,198 +232,147 @@ def process_day_file(date_str, logger, clear_existing=True):
         cursor = conn.cursor()
         logger.info("Connected to PostgreSQL database")
         
-        # Clear existing data if requested
-        if clear_existing:
-            success = remove_existing_data(date_str, conn, cursor, logger)
-            if not success:
+        # Bulk-load settings for this transaction only; the load is re-runnable,
+        # so not waiting on the WAL flush at commit is safe
+        cursor.execute("""
+            SET LOCAL synchronous_commit = off;
+            SET LOCAL work_mem = '256MB';
+            SET LOCAL maintenance_work_mem = '1GB';
+        """)
+        
+        # Clear existing data if requested, on a worker thread while this thread
+        # reads and parses the file (psycopg2 releases the GIL while the DELETE runs)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            delete_future = None
+            if clear_existing:
+                delete_future = executor.submit(remove_existing_data, date_str, conn, cursor, logger)
+            
+            breadcrumbs, line_count = read_breadcrumb_file(file_path, logger)
+            
+            if delete_future is not None and not delete_future.result():
                 logger.warning("Skipping file processing due to error in removing existing data")
                 return
         
-        breadcrumbs = []
-        # Read JSONL file (each line is a separate JSON object)
-        line_count = 0
-        with open(file_path, 'r') as f:
-            for line in f:
-                line_count += 1
-                try:
-                    bc = json.loads(line.strip())
-                    breadcrumbs.append(bc)
-                except json.JSONDecodeError:
-                    logger.warning(f"Error decoding JSON at line {line_count} in {file_path}")
-                    continue
-        
         logger.info(f"Read {len(breadcrumbs)} valid breadcrumbs from {line_count} lines")
         
         if not breadcrumbs:
             logger.warning(f"No breadcrumbs found in {file_path}")
             return
         
-        # Sort breadcrumbs by trip_id and timestamp
-        breadcrumbs.sort(key=lambda x: (x['EVENT_NO_TRIP'], x['ACT_TIME']))
+        # Reduce each record to a tuple of the fields we use, dropping the dicts
+        rows = list(map(BREADCRUMB_FIELDS, breadcrumbs))
+        del breadcrumbs
+        
+        # Transpose into columns and extract them as arrays, sized up front from the
+        # row count (null GPS/METERS values become NaN)
+        row_count = len(rows)
+        trip_id_col, act_time_col, meters_col, latitude_col, longitude_col, vehicle_ids, opd_dates = zip(*rows)
+        del rows
+        trip_ids = np.fromiter(trip_id_col, dtype=np.int64, count=row_count)
+        act_times = np.fromiter(act_time_col, dtype=np.int64, count=row_count)
+        meters = np.fromiter(meters_col, dtype=np.float64, count=row_count)
+        latitudes = np.fromiter(latitude_col, dtype=np.float64, count=row_count)
+        longitudes = np.fromiter(longitude_col, dtype=np.float64, count=row_count)
+        timestamps, keep = compute_timestamps(opd_dates, act_times, logger)
+        
+        # Sort breadcrumbs by trip_id and timestamp. np.lexsort is stable like list.sort;
+        # the array columns are reordered and the tuple columns are read through order.
+        order = np.lexsort((act_times, trip_ids))
+        trip_ids, act_times, meters, latitudes, longitudes, timestamps = (
+            trip_ids[order], act_times[order], meters[order], latitudes[order], longitudes[order], timestamps[order]
+        )
         logger.info(f"Sorted breadcrumbs by trip_id and ACT_TIME")
         
-        # Group by trip_id for processing
-        trips_data = {}
-        breadcrumbs_by_trip = {}
+        # Drop breadcrumbs whose OPD_DATE didn't parse before anything else uses them,
+        # so the trips, speeds and COPY rows are all built from the same breadcrumbs
+        if keep is not None and not keep.all():
+            keep = keep[order]
+            logger.warning(f"Skipping {np.count_nonzero(~keep)} breadcrumbs due to timestamp parsing errors")
+            order, trip_ids, act_times, meters, latitudes, longitudes, timestamps = (
+                order[keep], trip_ids[keep], act_times[keep], meters[keep], latitudes[keep], longitudes[keep], timestamps[keep]
+            )
         
-        for bc in breadcrumbs:
-            trip_id = bc['EVENT_NO_TRIP']
-            if trip_id not in breadcrumbs_by_trip:
-                breadcrumbs_by_trip[trip_id] = []
-            breadcrumbs_by_trip[trip_id].append(bc)
+        if not len(timestamps):
+            # Return without committing, so the DELETE of the day's existing data is rolled back
+            logger.warning(f"No breadcrumbs with a valid OPD_DATE in {file_path}")
+            return
+        
+        # Trip boundaries in the sorted trip_id column: one row per trip, no per-trip lists
+        unique_trip_ids, starts, counts = np.unique(trip_ids, return_index=True, return_counts=True)
+        trips_data = []
+        service_keys = {}
+        
+        for trip_id, first_row in zip(unique_trip_ids.tolist(), order[starts].tolist()):
+            # Determine service_key once per distinct OPD_DATE (a daily file has one)
+            opd_date = opd_dates[first_row]
+            if opd_date not in service_keys:
+                day = parse_opd_date(opd_date, logger)
+                service_keys[opd_date] = get_service_key(day)
+            service_key = service_keys[opd_date]
+            
+            # Default direction is 'Out' (equivalent to '0' in the schema)
+            direction = 'Out'
             
-            # Store trip data (only once per trip)
-            if trip_id not in trips_data:
-                # Determine service_key based on the day of the week from OPD_DATE
-                date_obj = bc['OPD_DATE'].split(':')[0]
-                day = int(date_obj[:2])
-                month_str = date_obj[2:5]
-                year = int(date_obj[5:])
-                
-                months = {
-                    'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4, 'MAY': 5, 'JUN': 6,
-                    'JUL': 7, 'AUG': 8, 'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12
-                }
-                month = months[month_str]
-                
-                # Create a date object to determine day of week
-                date_obj = datetime(year, month, day)
-                weekday = date_obj.weekday()
-                
-                # 5 = Saturday, 6 = Sunday, 0-4 = Weekday
-                if weekday == 5:
-                    service_key = 'Saturday'
-                elif weekday == 6:
-                    service_key = 'Sunday'
-                else:
-                    service_key = 'Weekday'
-                
-                # Default direction is 'Out' (equivalent to '0' in the schema)
-                direction = 'Out'
-                
-                trips_data[trip_id] = (
-                    trip_id,              # trip_id
-                    None,                 # route_id (to be populated later)
-                    bc['VEHICLE_ID'],     # vehicle_id
-                    service_key,          # service_key
-                    direction             # direction
-                )
+            trips_data.append((
+                trip_id,                 # trip_id
+                None,                    # route_id (to be populated later)
+                vehicle_ids[first_row],  # vehicle_id
+                service_key,             # service_key
+                direction                # direction
+            ))
         
         logger.info(f"Identified {len(trips_data)} unique trips")
         
         # Insert trips into Trip table
+        # The whole day loads in one transaction: ON CONFLICT DO NOTHING absorbs
+        # duplicates, and any other error rolls the day back so it can be re-run
         if trips_data:
-            try:
-                cursor.execute("SAVEPOINT before_trip_insert")
-                
-                trip_insert_query = '''
-                    INSERT INTO Trip (trip_id, route_id, vehicle_id, service_key, direction)
-                    VALUES %s
-                    ON CONFLICT (trip_id) DO NOTHING
-                '''
-                execute_values(cursor, trip_insert_query, list(trips_data.values()))
-                logger.info(f"Inserted trip data into Trip table")
-                
-                cursor.execute("RELEASE SAVEPOINT before_trip_insert")
-            except Exception as e:
-                cursor.execute("ROLLBACK TO SAVEPOINT before_trip_insert")
-                logger.error(f"Error inserting trips: {str(e)}")
-                # Continue with breadcrumbs for trips that might already exist
+            # All trips go in one statement: the rows are mogrified client-side and joined
+            trip_values = b','.join(cursor.mogrify("(%s,%s,%s,%s,%s)", trip) for trip in trips_data)
+            cursor.execute(
+                b"INSERT INTO Trip (trip_id, route_id, vehicle_id, service_key, direction) VALUES "
+                + trip_values
+                + b" ON CONFLICT (trip_id) DO NOTHING"
+            )
+            logger.info(f"Inserted trip data into Trip table")
         
-        # Process breadcrumbs and calculate speeds
-        breadcrumb_data = []
-        
-        for trip_id, trip_breadcrumbs in breadcrumbs_by_trip.items():
-            second_breadcrumb_speed = None
-            
-            # Process each breadcrumb in the trip
-            for i, bc in enumerate(trip_breadcrumbs):
-                timestamp = parse_timestamp(bc['OPD_DATE'], bc['ACT_TIME'], logger)
-                if timestamp is None:
-                    logger.warning(f"Skipping breadcrumb due to timestamp parsing error: {bc}")
-                    continue
-                    
-                speed = None
-                
-                # Calculate speed if not the first breadcrumb
-                if i > 0:
-                    prev_bc = trip_breadcrumbs[i-1]
-                    meters_diff = bc['METERS'] - prev_bc['METERS']
-                    time_diff = bc['ACT_TIME'] - prev_bc['ACT_TIME']
-                    
-                    if time_diff > 0:  # Avoid division by zero
-                        speed = meters_diff / time_diff  # meters per second
-                        
-                        # Store speed of second breadcrumb
-                        if i == 1:
-                            second_breadcrumb_speed = speed
-                
-                # For first breadcrumb, use speed of second breadcrumb (as per assignment)
-                if i == 0 and len(trip_breadcrumbs) > 1:
-                    # We'll update this after processing the second breadcrumb
-                    breadcrumb_data.append((
-                        timestamp,
-                        bc['GPS_LATITUDE'],
-                        bc['GPS_LONGITUDE'],
-                        None,  # Placeholder for speed
-                        trip_id
-                    ))
-                else:
-                    breadcrumb_data.append((
-                        timestamp,
-                        bc['GPS_LATITUDE'],
-                        bc['GPS_LONGITUDE'],
-                        speed,
-                        trip_id
-                    ))
-            
-            # Update first breadcrumb with second breadcrumb's speed if available
-            if second_breadcrumb_speed is not None and len(trip_breadcrumbs) > 1:
-                breadcrumb_data[0] = (
-                    breadcrumb_data[0][0],  # timestamp
-                    breadcrumb_data[0][1],  # latitude
-                    breadcrumb_data[0][2],  # longitude
-                    second_breadcrumb_speed,  # use second breadcrumb's speed
-                    breadcrumb_data[0][4]   # trip_id
-                )
+        # Calculate speeds on the columnar arrays
+        speeds = compute_speeds(act_times, meters, starts, counts)
         
-        logger.info(f"Processed {len(breadcrumb_data)} breadcrumbs with calculated speeds")
+        logger.info(f"Processed {len(timestamps)} breadcrumbs with calculated speeds")
         
         # Insert breadcrumbs into BreadCrumb table
-        if breadcrumb_data:
-            breadcrumb_insert_query = '''
-                INSERT INTO BreadCrumb (tstamp, latitude, longitude, speed, trip_id)
-                VALUES %s
-                ON CONFLICT DO NOTHING
-            '''
-            # Insert in batches of 1000 to avoid memory issues
-            batch_size = 1000
-            total_inserted = 0
-            errors = 0
-            
-            for i in range(0, len(breadcrumb_data), batch_size):
-                batch = breadcrumb_data[i:i+batch_size]
-                try:
-                    cursor.execute("SAVEPOINT before_batch_insert")
-                    execute_values(cursor, breadcrumb_insert_query, batch)
-                    rows_inserted = cursor.rowcount
-                    total_inserted += rows_inserted
-                    cursor.execute("RELEASE SAVEPOINT before_batch_insert")
-                    logger.info(f"Inserted batch of {rows_inserted} breadcrumbs ({total_inserted}/{len(breadcrumb_data)})")
-                except Exception as e:
-                    cursor.execute("ROLLBACK TO SAVEPOINT before_batch_insert")
-                    errors += 1
-                    logger.error(f"Error inserting batch {i//batch_size + 1}: {str(e)}")
-                    # Continue with next batch
+        # COPY can't skip conflicting rows, so bulk load into a temporary
+        # staging table and move the rows across with ON CONFLICT DO NOTHING
+        cursor.execute("""
+            CREATE TEMP TABLE breadcrumb_stage (
+                tstamp timestamp,
+                latitude float8,
+                longitude float8,
+                speed float8,
+                trip_id bigint
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert(
+            "COPY breadcrumb_stage (tstamp, latitude, longitude, speed, trip_id) FROM STDIN WITH (FORMAT BINARY)",
+            build_breadcrumb_copy_buffer(timestamps, latitudes, longitudes, speeds, trip_ids)
+        )
+        cursor.execute("""
+            INSERT INTO BreadCrumb (tstamp, latitude, longitude, speed, trip_id)
+            SELECT tstamp, latitude, longitude, speed, trip_id FROM breadcrumb_stage
+            ON CONFLICT DO NOTHING
+        """)
+        total_inserted = cursor.rowcount
+        logger.info(f"Inserted {total_inserted}/{len(timestamps)} breadcrumbs")
         
         # Run a query to verify data was inserted
-        cursor.execute("SELECT COUNT(*) FROM BreadCrumb WHERE DATE(tstamp) = %s", (date_str,))
+        cursor.execute("""
+            SELECT COUNT(*) FROM BreadCrumb
+            WHERE tstamp >= %(day)s::date AND tstamp < %(day)s::date + INTERVAL '1 day'
+        """, {'day': date_str})
         count = cursor.fetchone()[0]
         logger.info(f"Total breadcrumbs in database for {date_str}: {count}")
         
-        if errors > 0:
-            logger.warning(f"Completed with {errors} batch errors - some data may be missing")
-            
         # Commit changes
         conn.commit()
         logger.info(f"Successfully committed data to database")